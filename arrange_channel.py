@@ -1,5 +1,20 @@
 import json
 import os
+import sys
+import shutil
+import json_io
+
+def stream_priority(stream_url):
+    """
+    计算播放地址作为母项的优先级，数字越小越优先
+    HTTPS的IPv4(0) > HTTP的IPv4(1) > HTTPS的IPv6(2) > HTTP的IPv6(3) > 其他地址(4)
+    """
+    if not stream_url or not stream_url.startswith(("https://", "http://")):
+        return 4
+    priority = 0 if stream_url[4] == "s" else 1
+    if "[" in stream_url:
+        priority += 2
+    return priority
 
 def arrange_channels(input_file="playable_channels.json", output_file="channels_arrange.json"):
     """
@@ -14,96 +29,54 @@ def arrange_channels(input_file="playable_channels.json", output_file="channels_
     """
     try:
         # 读取输入JSON文件
-        with open(input_file, 'r', encoding='utf-8') as f:
-            channels = json.load(f)
+        channels = json_io.load(input_file)
         
         print(f"开始整理 {len(channels)} 个频道...")
         
-        # 按channel_name分组
+        # 按channel_name分组，分组的同时按优先级选择最佳母项
+        # 优先级：HTTPS的IPv4 > HTTP的IPv4 > HTTPS的IPv6 > HTTP的IPv6
         grouped_channels = {}
+        best_priorities = {}
         
         for key, channel_info in channels.items():
             channel_name = channel_info.get('channel_name', 'Unknown')
+            source_url = channel_info.get('source_url')
+            stream_url = channel_info.get('stream_url')
+            attributes = channel_info.get('attributes', {})
+            priority = stream_priority(stream_url)
             
-            if channel_name not in grouped_channels:
+            channel_group = grouped_channels.get(channel_name)
+            if channel_group is None:
                 # 第一次遇到这个频道名称，创建新的条目
                 grouped_channels[channel_name] = {
-                    "source_url": channel_info.get('source_url'),
+                    "source_url": source_url,
                     "channel_name": channel_name,
-                    "stream_url": channel_info.get('stream_url'),
-                    "attributes": channel_info.get('attributes', {}),
+                    "stream_url": stream_url,
+                    "attributes": attributes,
                     "childlist": []
                 }
-            else:
-                # 已经存在这个频道名称，将当前条目添加到childlist中
-                grouped_channels[channel_name]["childlist"].append({
-                    "source_url": channel_info.get('source_url'),
-                    "stream_url": channel_info.get('stream_url'),
-                    "attributes": channel_info.get('attributes', {})
-                })
-        
-        # 后处理：重新排序每个频道组，按照优先级选择最佳母项
-        # 优先级：HTTPS的IPv4 > HTTP的IPv4 > HTTPS的IPv6 > HTTP的IPv6
-        for channel_name, channel_group in grouped_channels.items():
-            # 获取所有条目（主条目+childlist中的条目）
-            all_entries = [channel_group] + channel_group["childlist"]
-            
-            # 按优先级排序条目
-            best_entry = None
-            
-            # 优先级1: HTTPS的IPv4地址
-            if not best_entry:
-                for entry in all_entries:
-                    stream_url = entry.get("stream_url", "")
-                    if stream_url.startswith("https://") and "[" not in stream_url:
-                        best_entry = entry
-                        break
-            
-            # 优先级2: HTTP的IPv4地址
-            if not best_entry:
-                for entry in all_entries:
-                    stream_url = entry.get("stream_url", "")
-                    if stream_url.startswith("http://") and "[" not in stream_url:
-                        best_entry = entry
-                        break
-            
-            # 优先级3: HTTPS的IPv6地址
-            if not best_entry:
-                for entry in all_entries:
-                    stream_url = entry.get("stream_url", "")
-                    if stream_url.startswith("https://") and "[" in stream_url:
-                        best_entry = entry
-                        break
-            
-            # 优先级4: HTTP的IPv6地址
-            if not best_entry:
-                for entry in all_entries:
-                    stream_url = entry.get("stream_url", "")
-                    if stream_url.startswith("http://") and "[" in stream_url:
-                        best_entry = entry
-                        break
-            
-            # 如果找到了更好的条目且不是当前主条目，则进行交换
-            if best_entry and best_entry != channel_group:
-                # 将当前主条目添加到childlist中
+                best_priorities[channel_name] = priority
+            elif priority < best_priorities[channel_name]:
+                # 当前条目优先级更高，将原母项降为子项，当前条目提升为母项
                 channel_group["childlist"].append({
                     "source_url": channel_group["source_url"],
                     "stream_url": channel_group["stream_url"],
                     "attributes": channel_group["attributes"]
                 })
-                
-                # 将找到的最佳条目设为新的主条目
-                channel_group["source_url"] = best_entry["source_url"]
-                channel_group["stream_url"] = best_entry["stream_url"]
-                channel_group["attributes"] = best_entry["attributes"]
-                
-                # 从childlist中移除已提升为母项的条目
-                channel_group["childlist"] = [entry for entry in channel_group["childlist"] 
-                                              if entry.get("stream_url") != best_entry["stream_url"]]
+                channel_group["source_url"] = source_url
+                channel_group["stream_url"] = stream_url
+                channel_group["attributes"] = attributes
+                best_priorities[channel_name] = priority
+            else:
+                # 已经存在这个频道名称，将当前条目添加到childlist中
+                channel_group["childlist"].append({
+                    "source_url": source_url,
+                    "stream_url": stream_url,
+                    "attributes": attributes
+                })
         
         # 保存到JSON文件
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(grouped_channels, f, ensure_ascii=False, indent=2)
+        json_io.dump(grouped_channels, output_file)
         
         print(f"整理完成，共合并为 {len(grouped_channels)} 个频道组，已保存到 {output_file}")
         return {
@@ -120,10 +93,14 @@ def arrange_channels(input_file="playable_channels.json", output_file="channels_
     except Exception as e:
         return {"error": f"处理文件时出错: {str(e)}"}
 
-def main():
+def main(pretty=False):
+    """
+    整理频道数据并更新channels_final.json
+
+    Args:
+        pretty (bool): 是否以缩进格式写入channels_final.json，方便人工查看
+    """
     print("开始整理频道数据...")
-    if os.path.exists('channels_arrange.json'):
-        os.remove('channels_arrange.json')
     result = arrange_channels()
     if result.get("success"):
         print("✓ 频道数据整理完成！")
@@ -131,20 +108,15 @@ def main():
         print(f"• 合并后频道组数: {result['grouped_channels']}")
         print(f"• 输出文件: {result['output_file']}")
         
-        # 清空channels_final.json并复制channels_arrange.json的内容
+        # 用channels_arrange.json的内容替换channels_final.json，替换是原子的，不会出现空文件或半个文件
         try:
-            # 如果channels_final.json存在，先清空它
-            if os.path.exists('channels_final.json'):
-                with open('channels_final.json', 'w', encoding='utf-8') as f:
-                    f.write('{}')  # 写入空的JSON对象
-            
-            # 读取channels_arrange.json的内容
-            with open('channels_arrange.json', 'r', encoding='utf-8') as source_file:
-                content = json.load(source_file)
-            
-            # 将内容写入channels_final.json
-            with open('channels_final.json', 'w', encoding='utf-8') as target_file:
-                json.dump(content, target_file, ensure_ascii=False, indent=2)
+            if pretty:
+                # 需要缩进格式时重新序列化
+                json_io.dump(json_io.load('channels_arrange.json'), 'channels_final.json', pretty=True)
+            else:
+                # 内容无需任何转换，直接复制文件，省去一次完整的解析和序列化
+                shutil.copyfile('channels_arrange.json', 'channels_final.json.tmp')
+                os.replace('channels_final.json.tmp', 'channels_final.json')
             
             print("✓ channels_final.json已更新")
         except Exception as e:
@@ -153,4 +125,4 @@ def main():
         print(f"✗ 整理失败: {result.get('error')}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(pretty="--pretty" in sys.argv[1:])
\ No newline at end of file
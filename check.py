@@ -1,84 +1,394 @@
 import os
-import requests
-from urllib.parse import urljoin
+import argparse
+import asyncio
+import aiohttp
+import httpx
+import ijson
+from urllib.parse import urljoin, urlsplit
 import re
 import sys
 import json
+import json_io
 
 
-def check_playable_channels_from_json(input_file="channels.json", output_file="playable_channels.json", timeout=10):
+# 网关类错误通常是暂时的，遇到时立即重试一次
+RETRY_STATUSES = (502, 503, 504)
+# 部分源站拒绝HEAD请求，遇到这些状态码时改用只取前两个字节的GET请求确认
+HEAD_REJECTED_STATUSES = (403, 405, 501)
+# 范围请求成功时返回206；不跟随重定向，3xx说明源站正常响应，同样视为可播放
+PLAYABLE_STATUSES = (200, 206, 301, 302, 303, 307, 308)
+# 范围GET请求的请求头
+RANGE_HEADERS = {'Range': 'bytes=0-1'}
+# aiohttp与httpx两种客户端的超时、连接错误和一般网络错误
+TIMEOUT_ERRORS = (asyncio.TimeoutError, httpx.TimeoutException)
+CONNECTION_ERRORS = (aiohttp.ClientConnectionError, httpx.TransportError)
+CLIENT_ERRORS = (aiohttp.ClientError, httpx.HTTPError)
+# HTTP/2客户端的连接池大小
+HTTP2_MAX_CONNECTIONS = 200
+HTTP2_MAX_KEEPALIVE_CONNECTIONS = 100
+
+
+async def tcp_connect(host, port, connect_timeout):
+    """尝试建立TCP连接，成功后立即关闭"""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), connect_timeout)
+        writer.close()
+        return True
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+
+def create_session(concurrency, timeout, connect_timeout, limit_per_host=0):
+    """
+    创建检测用的HTTP会话
+
+    Args:
+        concurrency (int): 连接池大小
+        timeout (float): 等待响应的读取超时时间（秒）
+        connect_timeout (float): 建立连接的超时时间（秒）
+        limit_per_host (int): 每个主机的最大连接数，0表示不限制
+
+    Returns:
+        aiohttp.ClientSession: HTTP会话
+    """
+    # 所有检测共享一个连接池，空闲连接保持60秒，同一主机的后续检测可复用已建立的TCP/TLS连接
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=limit_per_host, ttl_dns_cache=300,
+                                     keepalive_timeout=60)
+    # 分别限制建立连接和等待响应的时间，无法连接的主机在connect_timeout内即失败
+    client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=client_timeout)
+
+
+def create_http2_client(timeout, connect_timeout):
+    """
+    创建检测https地址用的HTTP/2客户端
+    同一源站的请求复用一个TLS连接并发传输，不必为每个请求建立连接
+
+    Args:
+        timeout (float): 等待响应的读取超时时间（秒）
+        connect_timeout (float): 建立连接的超时时间（秒）
+
+    Returns:
+        httpx.AsyncClient: HTTP/2客户端，源站不支持HTTP/2时自动使用HTTP/1.1
+    """
+    limits = httpx.Limits(max_connections=HTTP2_MAX_CONNECTIONS,
+                          max_keepalive_connections=HTTP2_MAX_KEEPALIVE_CONNECTIONS)
+    # 等待连接池空闲连接不计时，并发数已由StreamProber的信号量限制
+    client_timeout = httpx.Timeout(timeout, connect=connect_timeout, pool=None)
+    return httpx.AsyncClient(http2=True, limits=limits, timeout=client_timeout)
+
+
+class StreamProber:
+    """
+    并发检测播放地址是否可访问
+    同一次运行内共享HTTP会话、主机可达性检测结果和失效主机记录
+    """
+
+    def __init__(self, session, concurrency, connect_timeout, max_host_failures=2, http2_client=None,
+                 max_host_streams=100, max_host_connections=0):
+        """
+        Args:
+            session (aiohttp.ClientSession): 共享的HTTP会话，已设置连接/读取超时
+            concurrency (int): 同时进行的最大检测数
+            connect_timeout (float): TCP预检的连接超时时间（秒）
+            max_host_failures (int): 同一主机连续网络失败多少次后跳过该主机
+            http2_client (httpx.AsyncClient): 检测https地址用的HTTP/2客户端，为None时全部使用session
+            max_host_streams (int): 通过HTTP/2客户端对同一主机同时进行的最大检测数，
+                默认与常见服务器允许的最大并发流数一致，使一个连接即可承载
+            max_host_connections (int): 通过session对同一主机同时进行的最大检测数，应与session连接池的
+                limit_per_host一致，0表示不限制
+        """
+        self.session = session
+        self.http2_client = http2_client
+        self.max_host_streams = max_host_streams
+        self.max_host_connections = max_host_connections
+        # {netloc: 信号量}，限制对同一主机的并发数
+        self.host_sems = {}
+        self.sem = asyncio.Semaphore(concurrency)
+        self.connect_timeout = connect_timeout
+        self.max_host_failures = max_host_failures
+        # {(host, port): 连接任务}
+        self.host_tasks = {}
+        # {netloc: 连续网络失败次数}
+        self.host_failures = {}
+        self.dead_hosts = set()
+        # 因主机失效而跳过、实际未检测的地址
+        self.skipped_urls = set()
+
+    async def tcp_reachable(self, host, port):
+        """
+        通过TCP连接快速判断主机是否可达
+        同一(host, port)只连接一次，并发的检测共享同一个连接任务
+        """
+        cache_key = (host, port)
+        if cache_key not in self.host_tasks:
+            self.host_tasks[cache_key] = asyncio.ensure_future(tcp_connect(host, port, self.connect_timeout))
+        return await self.host_tasks[cache_key]
+
+    def uses_http2(self, stream_url):
+        """https地址在提供了HTTP/2客户端时通过它检测"""
+        return self.http2_client is not None and stream_url.startswith('https://')
+
+    async def head_status(self, stream_url):
+        """发送HEAD请求并返回状态码"""
+        if self.uses_http2(stream_url):
+            response = await self.http2_client.head(stream_url)
+            return response.status_code
+        async with self.session.head(stream_url, allow_redirects=False) as response:
+            return response.status
+
+    async def ranged_get_status(self, stream_url):
+        """
+        发送只取前两个字节的GET请求并返回状态码
+        206响应只有两个字节，读完后连接可放回连接池复用；其他响应（可能是完整的直播流）不读取内容，直接关闭连接
+        """
+        if self.uses_http2(stream_url):
+            async with self.http2_client.stream('GET', stream_url, headers=RANGE_HEADERS) as response:
+                if response.status_code == 206:
+                    await response.aread()
+                return response.status_code
+        async with self.session.get(stream_url, headers=RANGE_HEADERS, allow_redirects=False) as response:
+            if response.status == 206:
+                await response.read()
+            return response.status
+
+    async def fetch_status(self, stream_url):
+        """
+        发送HEAD请求并返回状态码
+        遇到网关错误时立即重试一次；HEAD被拒绝或连接被重置时改用范围GET请求重试一次；超时不重试
+        """
+        for attempt in range(2):
+            try:
+                status = await self.head_status(stream_url)
+                if status in RETRY_STATUSES and attempt == 0:
+                    continue
+                if status not in HEAD_REJECTED_STATUSES:
+                    return status
+                return await self.ranged_get_status(stream_url)
+            except TIMEOUT_ERRORS:
+                raise
+            except CONNECTION_ERRORS:
+                if attempt:
+                    raise
+                return await self.ranged_get_status(stream_url)
+
+    def record_host_failure(self, netloc):
+        """记录一次网络失败，连续失败达到上限的主机在本次运行中不再检测"""
+        failures = self.host_failures.get(netloc, 0) + 1
+        self.host_failures[netloc] = failures
+        if failures >= self.max_host_failures:
+            self.dead_hosts.add(netloc)
+
+    async def probe(self, stream_url, channel_name):
+        """
+        检测单个播放地址是否可访问
+        先用TCP连接排除无法连接的主机，只对可达的主机发送HEAD请求
+        对同一主机的并发数有限制时先按主机排队，排队期间不占用全局并发名额，
+        避免大量同一主机的检测占满全局名额却在等待该主机的连接
+
+        Args:
+            stream_url (str): 播放地址
+            channel_name (str): 频道名称，用于输出日志
+
+        Returns:
+            tuple: (stream_url, 是否可播放)
+        """
+        host_limit = self.max_host_streams if self.uses_http2(stream_url) else self.max_host_connections
+        if host_limit:
+            try:
+                netloc = urlsplit(stream_url).netloc
+            except ValueError:
+                # 无法解析的地址交给probe_now报告错误
+                return await self.probe_now(stream_url, channel_name)
+            if netloc not in self.host_sems:
+                self.host_sems[netloc] = asyncio.Semaphore(host_limit)
+            async with self.host_sems[netloc]:
+                return await self.probe_now(stream_url, channel_name)
+        return await self.probe_now(stream_url, channel_name)
+
+    async def probe_now(self, stream_url, channel_name):
+        """在全局并发限制内检测单个播放地址，参数和返回值同probe"""
+        async with self.sem:
+            netloc = None
+            try:
+                parts = urlsplit(stream_url)
+                netloc = parts.netloc
+                if netloc in self.dead_hosts:
+                    print(f"✗ {channel_name} - 主机 {netloc} 连续多次网络错误，已跳过")
+                    self.skipped_urls.add(stream_url)
+                    return stream_url, False
+
+                port = parts.port or (443 if parts.scheme == 'https' else 80)
+                if not await self.tcp_reachable(parts.hostname, port):
+                    print(f"✗ {channel_name} - 无法连接主机 {netloc}")
+                    return stream_url, False
+
+                # 发送HEAD请求检查URL是否可访问
+                status = await self.fetch_status(stream_url)
+                # 收到了HTTP响应，说明主机正常
+                self.host_failures[netloc] = 0
+                if status in PLAYABLE_STATUSES:
+                    print(f"✓ {channel_name} - 可播放")
+                    return stream_url, True
+                print(f"✗ {channel_name} - HTTP {status}")
+            except TIMEOUT_ERRORS:
+                self.record_host_failure(netloc)
+                print(f"✗ {channel_name} - 请求超时")
+            except CLIENT_ERRORS as e:
+                self.record_host_failure(netloc)
+                print(f"✗ {channel_name} - 网络错误: {str(e)}")
+            except Exception as e:
+                print(f"⚠ {channel_name} - 检测错误: {str(e)}")
+        return stream_url, False
+
+
+def ndjson_to_json(ndjson_file, output_file, key_order=None, pretty=False):
+    """
+    将逐行追加的NDJSON文件合并为一个JSON对象并写入文件
+
+    Args:
+        ndjson_file (str): NDJSON文件路径，每行一个 {key: value} 对象
+        output_file (str): 输出的JSON文件路径
+        key_order (iterable): 按该顺序输出键，为None时保持NDJSON中的顺序
+        pretty (bool): 是否缩进输出
+
+    Returns:
+        dict: 合并后的字典
+    """
+    merged = {}
+    with open(ndjson_file, 'rb', buffering=1 << 16) as f:
+        for line in f:
+            if line.strip():
+                merged.update(json_io.loads(line))
+
+    if key_order is not None:
+        merged = {key: merged[key] for key in key_order if key in merged}
+
+    json_io.dump(merged, output_file, pretty=pretty)
+    return merged
+
+
+async def check_channels(channel_items, ndjson_file, timeout, connect_timeout, concurrency, save_interval):
+    """
+    并发检测所有频道，边解析边检测边存储
+    相同的播放地址只检测一次，结果共享给所有引用它的频道
+    每个可播放的频道追加一行到ndjson_file，避免反复重写整个文件
+
+    Args:
+        channel_items (iterable): 逐条产生的 (key, channel_info)
+        ndjson_file (str): 检测结果的NDJSON文件路径
+
+    Returns:
+        tuple: (按输入顺序排列的全部频道键, 可播放频道数)
+    """
+    # 只保留频道键用于输出排序；频道信息只在其播放地址等待检测结果期间保留
+    channel_keys = []
+    # {等待检测结果的播放地址: [(频道键, 频道信息)]}
+    unique_urls = {}
+    playable_count = 0
+    checked_count = 0
+
+    with open(ndjson_file, 'wb', buffering=1 << 16) as out:
+        async with create_session(concurrency, timeout, connect_timeout) as session, \
+                create_http2_client(timeout, connect_timeout) as http2_client:
+            prober = StreamProber(session, concurrency, connect_timeout, http2_client=http2_client)
+            tasks = []
+            for key, channel_info in channel_items:
+                channel_keys.append(key)
+                stream_url = channel_info.get('stream_url')
+                if not stream_url:
+                    continue
+                if stream_url in unique_urls:
+                    # 重复的播放地址不再检测，只记录频道
+                    unique_urls[stream_url].append((key, channel_info))
+                    continue
+                unique_urls[stream_url] = [(key, channel_info)]
+                tasks.append(asyncio.ensure_future(prober.probe(stream_url,
+                                                                channel_info.get('channel_name', 'Unknown'))))
+                # 定期让出事件循环，使检测与解析同时进行
+                if len(tasks) % 100 == 0:
+                    await asyncio.sleep(0)
+            total = len(tasks)
+            print(f"解析完成，共 {len(channel_keys)} 个频道，去重后 {total} 个不同的播放地址")
+
+            # 自上次落盘后是否有新的可播放频道写入
+            dirty = False
+            for next_done in asyncio.as_completed(tasks):
+                stream_url, playable = await next_done
+                # 结果已出，释放等待该地址的频道信息
+                waiting_channels = unique_urls.pop(stream_url)
+                if playable:
+                    # 检测通过，所有使用该地址的频道各追加一行
+                    for key, channel_info in waiting_channels:
+                        out.write(json_io.dumps({key: channel_info}) + b"\n")
+                        playable_count += 1
+                    dirty = True
+                checked_count += 1
+
+                # 每检测save_interval个地址就落盘一次，实现边检测边存储；没有新结果时跳过写入
+                if checked_count % save_interval == 0:
+                    if dirty:
+                        out.flush()
+                        dirty = False
+                    print(f"进度: {checked_count}/{total}, 可播放: {playable_count}")
+
+    print(f"进度: {checked_count}/{total}, 可播放: {playable_count}")
+    return channel_keys, playable_count
+
+
+def check_playable_channels_from_json(input_file="channels.json", output_file="playable_channels.json", timeout=4,
+                                      connect_timeout=2, concurrency=512, save_interval=100):
     """
     从JSON文件中读取播放地址，检测可用性并生成新的JSON文件
-    边解析边检测边存储
+    使用ijson流式解析输入文件，asyncio并发检测，边解析边检测边存储
     
     Args:
         input_file (str): 输入的JSON文件路径
         output_file (str): 输出的JSON文件路径
-        timeout (int): 请求超时时间（秒）
+        timeout (int): 等待响应的读取超时时间（秒）
+        connect_timeout (int): 建立连接的超时时间（秒），同时用于TCP预检
+        concurrency (int): 同时进行的最大请求数
+        save_interval (int): 每完成多少个检测保存一次
     
     Returns:
         dict: 包含处理结果的字典
     """
     try:
-        # 读取输入JSON文件
-        with open(input_file, 'r', encoding='utf-8') as f:
-            channels = json.load(f)
-        
-        print(f"开始检测 {len(channels)} 个播放地址...")
-        
-        playable_channels = {}
-        checked_count = 0
-        
-        # 逐个检测播放地址
-        for key, channel_info in channels.items():
-            stream_url = channel_info.get('stream_url')
-            if not stream_url:
-                continue
-            
-            try:
-                # 发送HEAD请求检查URL是否可访问
-                response = requests.head(stream_url, timeout=timeout, allow_redirects=True)
-                if response.status_code == 200:
-                    # 检测通过，保存到可播放频道字典
-                    playable_channels[key] = channel_info
-                    print(f"✓ {channel_info.get('channel_name', 'Unknown')} - 可播放")
-                else:
-                    print(f"✗ {channel_info.get('channel_name', 'Unknown')} - HTTP {response.status_code}")
-            except requests.exceptions.Timeout:
-                print(f"✗ {channel_info.get('channel_name', 'Unknown')} - 请求超时")
-            except requests.exceptions.RequestException as e:
-                print(f"✗ {channel_info.get('channel_name', 'Unknown')} - 网络错误: {str(e)}")
-            except Exception as e:
-                print(f"⚠ {channel_info.get('channel_name', 'Unknown')} - 检测错误: {str(e)}")
-            
-            checked_count += 1
-            
-            # 每检测10个地址就保存一次，实现边检测边存储
-            if checked_count % 10 == 0 or checked_count == len(channels):
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    json.dump(playable_channels, f, ensure_ascii=False, indent=2)
-                print(f"进度: {checked_count}/{len(channels)}, 可播放: {len(playable_channels)}")
+        ndjson_file = os.path.splitext(output_file)[0] + '.ndjson'
+
+        # 流式读取输入JSON文件，每解析出一个频道就提交检测
+        with open(input_file, 'rb', buffering=1 << 16) as f:
+            print(f"开始检测 {input_file} 中的播放地址...")
+            channel_keys, _ = asyncio.run(check_channels(ijson.kvitems(f, '', use_float=True), ndjson_file,
+                                                         timeout, connect_timeout,
+                                                         concurrency, save_interval))
+
+        # 按输入顺序输出，保证后续整理时母项的选择与检测完成顺序无关
+        playable_channels = ndjson_to_json(ndjson_file, output_file, key_order=channel_keys)
+        os.remove(ndjson_file)
         
         print(f"检测完成！共 {len(playable_channels)} 个可播放地址，已保存到 {output_file}")
         return {
             "success": True,
-            "total_channels": len(channels),
+            "total_channels": len(channel_keys),
             "playable_channels": len(playable_channels),
             "output_file": output_file
         }
         
     except FileNotFoundError:
         return {"error": f"文件未找到: {input_file}"}
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, ijson.JSONError):
         return {"error": f"JSON文件格式错误: {input_file}"}
     except Exception as e:
         return {"error": f"处理文件时出错: {str(e)}"}
 
-def main():
-    if os.path.exists('playable_channels.json'):
-        os.remove('playable_channels.json')
-    check_playable_channels_from_json()
+def main(timeout=4, connect_timeout=2):
+    check_playable_channels_from_json(timeout=timeout, connect_timeout=connect_timeout)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="检测channels.json中的播放地址是否可用")
+    parser.add_argument("--timeout", type=float, default=4, help="等待响应的读取超时时间（秒）")
+    parser.add_argument("--connect-timeout", type=float, default=2, help="建立连接的超时时间（秒）")
+    args = parser.parse_args()
+    main(timeout=args.timeout, connect_timeout=args.connect_timeout)
     
@@ -0,0 +1,75 @@
+"""
+JSON读写工具
+优先使用orjson（C实现，比标准库json快数倍），未安装时回退到标准库json
+orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，调用方统一捕获后者即可
+"""
+import json
+import mmap
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 超过该大小的文件通过mmap交给orjson解析，避免再复制一份完整的文件内容
+MMAP_THRESHOLD = 4 << 20
+
+
+def loads(data):
+    """
+    解析JSON
+
+    Args:
+        data (bytes | str): JSON文本
+
+    Returns:
+        解析得到的对象
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, pretty=False):
+    """
+    序列化为UTF-8编码的JSON字节串
+
+    Args:
+        obj: 要序列化的对象
+        pretty (bool): 是否缩进2格输出，默认紧凑输出
+
+    Returns:
+        bytes: JSON字节串
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def load(file_path):
+    """
+    从文件读取JSON
+    大文件使用mmap映射后直接解析，小文件直接读取（mmap的建立开销不划算）
+    """
+    with open(file_path, 'rb', buffering=1 << 16) as f:
+        if orjson is not None and os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                return orjson.loads(view)
+        return loads(f.read())
+
+
+def dump(obj, file_path, pretty=False):
+    """
+    将对象以JSON格式写入文件
+    先写入临时文件再原子替换，读取方不会看到写了一半的文件
+    """
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb', buffering=1 << 16) as f:
+        f.write(dumps(obj, pretty=pretty))
+    os.replace(tmp_path, file_path)
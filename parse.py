@@ -1,90 +1,81 @@
-import os
 import requests
 from urllib.parse import urljoin
 import re
 import sys
-import json
+import json_io
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def parse_m3u_to_json(m3u_url, output_file="channels.json"):
+# EXTINF解析用的正则，模块加载时编译一次
+_NAME_RE = re.compile(r',([^,]+)$')
+_INVALID_CHARS_RE = re.compile(r'[<>:"/\\|?*]')
+# 需要提取的EXTINF属性及其在行中的前缀
+_ATTR_PREFIXES = tuple((name, f'{name}="') for name in ('tvg-id', 'tvg-name', 'tvg-logo', 'group-title'))
+# 同时下载的M3U源数量
+MAX_DOWNLOAD_WORKERS = 16
+
+def parse_m3u_to_json(m3u_url, all_channels):
     """
-    从M3U URL解析所有播放地址到JSON文件
+    从M3U URL解析所有播放地址，合并到all_channels中
+    解析成功后才合并，下载或解析失败时all_channels保持不变
     
     Args:
         m3u_url (str): M3U文件的URL地址
-        output_file (str): 输出JSON文件路径
+        all_channels (dict): 汇总所有源的频道字典，由调用方统一写入文件
     
     Returns:
         dict: 包含处理结果的字典
     """
     
     try:
-        # 下载M3U文件
+        # 流式下载M3U文件，边下载边逐行解析
         print(f"正在下载M3U文件: {m3u_url}")
-        response = requests.get(m3u_url, timeout=30)
-        response.raise_for_status()
-        
-        content = response.text
-        lines = content.split('\n')
-        
-        # 检查文件格式
-        if not lines or not lines[0].strip().startswith('#EXTM3U'):
-            return {"error": "无效的M3U文件格式"}
-        
-        channels = {}
-        current_channel_info = None
-        channel_index = 0
+        with requests.get(m3u_url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            # 响应未声明编码时按UTF-8解码（流式读取无法预先探测编码）
+            if response.encoding is None:
+                response.encoding = 'utf-8'
+            lines = response.iter_lines(chunk_size=1 << 16, decode_unicode=True)
+            
+            # 检查文件格式
+            first_line = next(lines, '')
+            if not first_line.strip().startswith('#EXTM3U'):
+                return {"error": "无效的M3U文件格式"}
+            
+            channels = {}
+            # 当前EXTINF行解析出的频道信息，None表示尚未遇到EXTINF或已被使用
+            channel_name = None
+            attributes = None
+            channel_index = 0
         
-        # 解析M3U文件
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+            # 解析M3U文件
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
                 
-            if line.startswith('#EXTINF'):
-                # 解析频道信息
-                channel_name = extract_channel_name(line)
-                attributes = extract_attributes(line)
-                current_channel_info = {
-                    'name': channel_name,
-                    'attributes': attributes
-                }
-            elif line.startswith('http'):
-                if current_channel_info:
-                    channel_key = f"{m3u_url}_{channel_index}"
-                    channels[channel_key] = {
-                        'source_url': m3u_url,
-                        'channel_name': current_channel_info['name'],
-                        'stream_url': line,
-                        'attributes': current_channel_info['attributes']
-                    }
-                    channel_index += 1
-                    # 重置当前频道信息
-                    current_channel_info = None
+                if line.startswith('#EXTINF'):
+                    # 解析频道信息
+                    channel_name = extract_channel_name(line)
+                    attributes = extract_attributes(line)
+                elif line.startswith('http'):
+                    if channel_name is not None:
+                        channel_key = f"{m3u_url}_{channel_index}"
+                        channels[channel_key] = {
+                            'source_url': m3u_url,
+                            'channel_name': channel_name,
+                            'stream_url': line,
+                            'attributes': attributes
+                        }
+                        channel_index += 1
+                        # 重置当前频道信息
+                        channel_name = None
         
-        # 保存到JSON文件（追加模式）
-        try:
-            # 尝试读取现有文件
-            if os.path.exists(output_file):
-                with open(output_file, 'r', encoding='utf-8') as f:
-                    existing_channels = json.load(f)
-                # 合并现有数据和新数据
-                existing_channels.update(channels)
-                final_channels = existing_channels
-            else:
-                final_channels = channels
-        except (json.JSONDecodeError, FileNotFoundError):
-            # 如果文件不存在或格式错误，则使用新数据
-            final_channels = channels
+        all_channels.update(channels)
         
-        # 写入合并后的数据
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(final_channels, f, ensure_ascii=False, indent=2)
-        
-        print(f"解析完成，共找到 {len(channels)} 个播放地址，已保存到 {output_file}")
+        print(f"解析完成: {m3u_url}，共找到 {len(channels)} 个播放地址")
         return {
             "success": True,
-            "total_channels": len(channels),
-            "output_file": output_file
+            "total_channels": len(channels)
         }
         
     except requests.RequestException as e:
@@ -95,42 +86,58 @@ def parse_m3u_to_json(m3u_url, output_file="channels.json"):
 def extract_channel_name(extinf_line):
     """从EXTINF行中提取频道名称[1](@ref)"""
     # 格式: #EXTINF:-1 tvg-id="..." tvg-name="...",频道名称
-    match = re.search(r',([^,]+)$', extinf_line)
+    match = _NAME_RE.search(extinf_line)
     if match:
         return match.group(1).strip()
     return "未知频道"
 
 def extract_attributes(extinf_line):
     """提取EXTINF行中的属性[2](@ref)"""
-    attributes = {}
-    # 提取tvg-id, tvg-name, tvg-logo, group-title等属性
-    patterns = {
-        'tvg-id': r'tvg-id="([^"]*)"',
-        'tvg-name': r'tvg-name="([^"]*)"', 
-        'tvg-logo': r'tvg-logo="([^"]*)"',
-        'group-title': r'group-title="([^"]*)"'
-    }
-    
-    for key, pattern in patterns.items():
-        match = re.search(pattern, extinf_line)
-        if match:
-            attributes[key] = match.group(1)
-    
-    return attributes
+    # 用str.find定位tvg-id, tvg-name, tvg-logo, group-title等属性，重复出现时保留第一个
+    found = []
+    for name, prefix in _ATTR_PREFIXES:
+        start = extinf_line.find(prefix)
+        if start < 0:
+            continue
+        start += len(prefix)
+        end = extinf_line.find('"', start)
+        if end >= 0:
+            found.append((start, name, extinf_line[start:end]))
+    # 按属性在行中出现的顺序输出
+    found.sort()
+    return {name: value for _, name, value in found}
 
 def sanitize_filename(filename):
     """清理文件名，移除非法字符"""
-    invalid_chars = r'[<>:"/\\|?*]'
-    return re.sub(invalid_chars, '_', filename)
+    return _INVALID_CHARS_RE.sub('_', filename)
 
-def main():
-    if os.path.exists('channels.json'):
-        os.remove('channels.json')
-    channels = json.load(open('channels_url.json'))
+def main(output_file="channels.json"):
+    channels = json_io.load('channels_url.json')
+    all_channels = {}
     if channels is not None:
-        for key, url in channels.items():
-            print(f"正在解析 {key}: {url}")
-            parse_m3u_to_json(url)
+        # 各源互不依赖，在线程池中并发下载解析；每个源写入各自的字典，结束后按原顺序合并
+        source_channels = [{} for _ in channels]
+        with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+            # {future: (源名称, 源地址)}，用于在结果返回时报告是哪个源
+            futures = {}
+            for (key, url), parsed in zip(channels.items(), source_channels):
+                print(f"正在解析 {key}: {url}")
+                futures[executor.submit(parse_m3u_to_json, url, parsed)] = (key, url)
+            for future in as_completed(futures):
+                key, url = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"error": f"处理文件时出错: {str(e)}"}
+                if result.get("success"):
+                    print(f"✓ {key}: {url} - {result['total_channels']} 个播放地址")
+                else:
+                    print(f"✗ {key}: {url} - {result.get('error')}")
+        for parsed in source_channels:
+            all_channels.update(parsed)
+    # 所有源解析完成后一次性写入（原子替换，同时覆盖上次运行的结果）
+    json_io.dump(all_channels, output_file)
+    print(f"共解析 {len(all_channels)} 个播放地址，已保存到 {output_file}")
 
 if __name__ == "__main__":
     # 默认使用您提供的URL
@@ -1,136 +1,301 @@
 import os
-import requests
+import argparse
+import time
+import asyncio
+import ijson
 from urllib.parse import urljoin
 import re
 import sys
 import json
+import json_io
+from check import StreamProber, create_session, create_http2_client, ndjson_to_json
 
 
-def recheck_arranged_channels(input_file="channels_arrange.json", output_file="channels_final.json", timeout=10):
+# 检测失败的地址在该时间内（秒）不再重复检测
+FAILURE_CACHE_TTL = 24 * 60 * 60
+# 对同一主机同时进行的最大检测数
+MAX_HOST_CONNECTIONS = 10
+
+
+def load_failure_cache(cache_file, now):
+    """
+    读取检测失败地址的缓存，丢弃已过期的记录
+
+    Args:
+        cache_file (str): 缓存文件路径，内容为 {播放地址: 检测失败的时间戳}
+        now (float): 当前时间戳
+
+    Returns:
+        dict: 未过期的 {播放地址: 检测失败的时间戳}；缓存文件不存在或内容格式不对时返回空字典
+    """
+    try:
+        cache = json_io.load(cache_file)
+        # 缓存只是加速手段，格式不对（非字典、时间戳非数字等）时当作没有缓存，不中断检测
+        return {url: failed_at for url, failed_at in cache.items()
+                if isinstance(url, str) and isinstance(failed_at, (int, float)) and not isinstance(failed_at, bool)
+                and now - failed_at < FAILURE_CACHE_TTL}
+    except Exception:
+        return {}
+
+
+def select_group(channel_name, channel_group, playable_urls, keep_all_children=True):
+    """
+    根据检测结果整理一个频道组
+
+    Args:
+        channel_name (str): 频道组名称，用于输出日志
+        channel_group (dict): 整理前的频道组
+        playable_urls (dict): {播放地址: 是否可播放}，keep_all_children为True时须包含该组的所有地址，
+            否则只需包含截至第一个可播放项的地址
+        keep_all_children (bool): 是否保留所有可用的子项，为False时只保留一个可播放的地址
+
+    Returns:
+        dict: 整理后的频道组，所有项都不可播放时返回None
+    """
+    main_stream_url = channel_group.get('stream_url')
+    main_playable = bool(main_stream_url) and playable_urls[main_stream_url]
+    playable_childlist = []
+    if keep_all_children or not main_playable:
+        for child_entry in channel_group.get('childlist', []):
+            child_stream_url = child_entry.get('stream_url')
+            if child_stream_url and playable_urls[child_stream_url]:
+                playable_childlist.append(child_entry)
+                if not keep_all_children:
+                    break
+    
+    if main_playable:
+        # 主项可用，保留主项和所有可用的子项（不保留全部子项时childlist为空）
+        return {
+            "source_url": channel_group.get('source_url'),
+            "channel_name": channel_group.get('channel_name'),
+            "stream_url": main_stream_url,
+            "attributes": channel_group.get('attributes', {}),
+            "childlist": playable_childlist
+        }
+    if playable_childlist:
+        # 主项不可用但有可用的子项，将第一个可用子项提升为主项
+        first_playable = playable_childlist[0]
+        print(f"↑ {channel_name} - 主项已替换为第一个可用子项")
+        return {
+            "source_url": first_playable.get('source_url'),
+            "channel_name": channel_group.get('channel_name'),
+            "stream_url": first_playable.get('stream_url'),
+            "attributes": first_playable.get('attributes', {}),
+            "childlist": playable_childlist[1:]  # 剩余的子项
+        }
+    # 主项和所有子项都不可用，跳过这个频道组
+    print(f"⊘ {channel_name} - 所有项都不可播放，已删除")
+    return None
+
+
+def group_stream_urls(channel_name, channel_group):
+    """
+    按主项、子项的顺序列出频道组中的播放地址
+
+    Returns:
+        list: [(播放地址, 用于输出日志的名称)]
+    """
+    stream_urls = []
+    main_stream_url = channel_group.get('stream_url')
+    if main_stream_url:
+        stream_urls.append((main_stream_url, f"{channel_name} 主项"))
+    for i, child_entry in enumerate(channel_group.get('childlist', [])):
+        child_stream_url = child_entry.get('stream_url')
+        if child_stream_url:
+            stream_urls.append((child_stream_url, f"{channel_name} 子项{i+1}"))
+    return stream_urls
+
+
+async def check_groups(channel_items, playable_urls, ndjson_file, timeout, connect_timeout, concurrency,
+                       save_interval, keep_all_children=True):
+    """
+    并发检测各频道组的地址，边解析边检测边存储
+    相同的播放地址只检测一次，一个组的地址全部有结果后立即整理该组
+    不保留全部子项时，各组按主项、子项的顺序逐个检测，找到第一个可播放的地址即整理该组，其余地址不再检测
+    整理后的频道组追加一行到ndjson_file，避免反复重写整个文件
+
+    Args:
+        channel_items (iterable): 逐个产生的 (频道组名称, 频道组)
+        playable_urls (dict): 已知的 {播放地址: 是否可播放}，检测结果也写入其中
+        ndjson_file (str): 整理结果的NDJSON文件路径
+        timeout (int): 等待响应的读取超时时间（秒）
+        connect_timeout (int): 建立连接的超时时间（秒）
+        concurrency (int): 同时进行的最大检测数
+        save_interval (int): 每整理多少个频道组刷新一次文件
+        keep_all_children (bool): 是否保留所有可用的子项
+
+    Returns:
+        tuple: (按输入顺序排列的所有频道组名称, 因主机失效而跳过、实际未检测的地址集合)
+    """
+    channel_names = []
+    
+    def register(items):
+        for channel_name, channel_group in items:
+            channel_names.append(channel_name)
+            yield channel_name, channel_group
+    
+    finished_count = 0
+    with open(ndjson_file, 'wb', buffering=1 << 16) as out:
+        def finish(channel_name, channel_group):
+            nonlocal finished_count
+            record = select_group(channel_name, channel_group, playable_urls, keep_all_children)
+            if record is not None:
+                out.write(json_io.dumps({channel_name: record}) + b"\n")
+            finished_count += 1
+            if finished_count % save_interval == 0:
+                out.flush()
+        
+        async with create_session(concurrency * 2, timeout, connect_timeout, limit_per_host=MAX_HOST_CONNECTIONS) \
+                as session, create_http2_client(timeout, connect_timeout) as http2_client:
+            prober = StreamProber(session, concurrency, connect_timeout, http2_client=http2_client,
+                                  max_host_streams=MAX_HOST_CONNECTIONS, max_host_connections=MAX_HOST_CONNECTIONS)
+            if keep_all_children:
+                await check_all_urls(register(channel_items), playable_urls, prober, finish)
+            else:
+                await check_until_playable(register(channel_items), playable_urls, prober, finish)
+    
+    return channel_names, prober.skipped_urls
+
+
+async def check_all_urls(channel_items, playable_urls, prober, finish):
+    """检测所有地址，一个频道组的地址全部有结果后调用finish整理该组"""
+    # 等待检测结果的频道组及其还在等待的地址数，以及 {播放地址: 等待该地址的频道组名称列表}
+    waiting_groups = {}
+    pending_counts = {}
+    url_groups = {}
+    tasks = []
+    parsed_count = 0
+    for channel_name, channel_group in channel_items:
+        parsed_count += 1
+        pending_urls = {}
+        for url, label in group_stream_urls(channel_name, channel_group):
+            if url not in playable_urls:
+                pending_urls.setdefault(url, label)
+        if not pending_urls:
+            # 地址都已知结果（或没有地址）的频道组无需等待检测
+            finish(channel_name, channel_group)
+            continue
+        
+        waiting_groups[channel_name] = channel_group
+        pending_counts[channel_name] = len(pending_urls)
+        for url, label in pending_urls.items():
+            if url not in url_groups:
+                url_groups[url] = []
+                tasks.append(asyncio.ensure_future(prober.probe(url, label)))
+            url_groups[url].append(channel_name)
+        # 定期让出事件循环，使检测与解析同时进行
+        if parsed_count % 100 == 0:
+            await asyncio.sleep(0)
+    print(f"解析完成，共 {parsed_count} 个频道组，去重后需检测 {len(tasks)} 个不同的播放地址")
+    
+    for task in asyncio.as_completed(tasks):
+        url, playable = await task
+        playable_urls[url] = playable
+        for channel_name in url_groups.pop(url):
+            pending_counts[channel_name] -= 1
+            if pending_counts[channel_name] == 0:
+                del pending_counts[channel_name]
+                finish(channel_name, waiting_groups.pop(channel_name))
+
+
+async def check_until_playable(channel_items, playable_urls, prober, finish):
+    """各频道组按顺序检测地址，找到第一个可播放的地址后调用finish整理该组"""
+    # {播放地址: 检测任务}，多个频道组共用的地址只检测一次
+    url_tasks = {}
+    
+    async def is_playable(url, label):
+        if url not in playable_urls:
+            if url not in url_tasks:
+                url_tasks[url] = asyncio.ensure_future(prober.probe(url, label))
+            playable_urls[url] = (await url_tasks[url])[1]
+        return playable_urls[url]
+    
+    async def check_group(channel_name, channel_group):
+        for url, label in group_stream_urls(channel_name, channel_group):
+            if await is_playable(url, label):
+                break
+        finish(channel_name, channel_group)
+    
+    tasks = []
+    for channel_name, channel_group in channel_items:
+        tasks.append(asyncio.ensure_future(check_group(channel_name, channel_group)))
+        # 定期让出事件循环，使检测与解析同时进行
+        if len(tasks) % 100 == 0:
+            await asyncio.sleep(0)
+    print(f"解析完成，共 {len(tasks)} 个频道组")
+    await asyncio.gather(*tasks)
+
+
+def recheck_arranged_channels(input_file="channels_arrange.json", output_file="channels_final.json", timeout=10,
+                              connect_timeout=2, concurrency=100, cache_file="recheck_failures.json", save_interval=10,
+                              keep_all_children=True, pretty=False):
     """
     重新检测channels_arrange.json中的播放地址，删除不可用的项
     如果主项不可用，则从childlist中选择第一个可用的作为主项
     如果主项和childlist都不可用，则删除整个频道组
+    使用ijson流式解析输入文件，地址去重后并发检测，每个频道组的地址检测完后立即整理并追加到NDJSON检查点，
+    最后合并为输出文件
+    24小时内检测失败过的地址直接视为不可播放，不再发送请求
     
     Args:
         input_file (str): 输入的JSON文件路径
         output_file (str): 输出的JSON文件路径
-        timeout (int): 请求超时时间（秒）
+        timeout (int): 等待响应的读取超时时间（秒）
+        connect_timeout (int): 建立连接的超时时间（秒）
+        concurrency (int): 同时进行的最大检测数
+        cache_file (str): 检测失败地址的缓存文件路径，为None时不使用缓存
+        save_interval (int): 每整理多少个频道组刷新一次检查点文件
+        keep_all_children (bool): 是否保留所有可用的子项；为False时每个频道组只保留一个可播放的地址，
+            找到后不再检测其余子项
+        pretty (bool): 是否以缩进格式写入输出文件，方便人工查看
     
     Returns:
         dict: 包含处理结果的字典
     """
     try:
-        # 读取输入JSON文件
-        with open(input_file, 'r', encoding='utf-8') as f:
-            channels = json.load(f)
+        now = time.time()
+        failure_cache = load_failure_cache(cache_file, now) if cache_file else {}
+        if failure_cache:
+            print(f"{len(failure_cache)} 个地址在24小时内检测失败过，本次直接跳过")
+        playable_urls = dict.fromkeys(failure_cache, False)
         
-        print(f"开始重新检测 {len(channels)} 个频道组...")
+        ndjson_file = os.path.splitext(output_file)[0] + '.ndjson'
+        # 流式读取输入JSON文件，每解析出一个频道组就提交检测
+        with open(input_file, 'rb', buffering=1 << 16) as f:
+            print(f"开始重新检测 {input_file} 中的频道组...")
+            channel_names, skipped_urls = asyncio.run(check_groups(ijson.kvitems(f, '', use_float=True), playable_urls,
+                                                                   ndjson_file, timeout, connect_timeout, concurrency,
+                                                                   save_interval, keep_all_children))
         
-        final_channels = {}
-        checked_groups = 0
+        if cache_file:
+            # 只记录本次实际检测失败的地址，因主机失效跳过的不记录；已缓存的保留原时间戳
+            for url, playable in playable_urls.items():
+                if not playable and url not in skipped_urls:
+                    failure_cache.setdefault(url, now)
+            json_io.dump(failure_cache, cache_file)
         
-        # 逐个检测频道组
-        for channel_name, channel_group in channels.items():
-            # 检测主项
-            main_stream_url = channel_group.get('stream_url')
-            main_playable = False
-            
-            if main_stream_url:
-                try:
-                    # 发送HEAD请求检查URL是否可访问
-                    response = requests.head(main_stream_url, timeout=timeout, allow_redirects=True)
-                    main_playable = response.status_code == 200
-                    if main_playable:
-                        print(f"✓ {channel_name} - 主项可播放")
-                    else:
-                        print(f"✗ {channel_name} - 主项不可播放 (HTTP {response.status_code})")
-                except requests.exceptions.Timeout:
-                    print(f"✗ {channel_name} - 主项请求超时")
-                except requests.exceptions.RequestException as e:
-                    print(f"✗ {channel_name} - 主项网络错误: {str(e)}")
-                except Exception as e:
-                    print(f"⚠ {channel_name} - 主项检测错误: {str(e)}")
-            
-            # 检测childlist中的项
-            playable_childlist = []
-            childlist = channel_group.get('childlist', [])
-            
-            for i, child_entry in enumerate(childlist):
-                child_stream_url = child_entry.get('stream_url')
-                if not child_stream_url:
-                    continue
-                
-                try:
-                    # 发送HEAD请求检查URL是否可访问
-                    response = requests.head(child_stream_url, timeout=timeout, allow_redirects=True)
-                    if response.status_code == 200:
-                        # 检测通过，保存到可播放列表
-                        playable_childlist.append(child_entry)
-                        print(f"✓ {channel_name} - 子项{i+1}可播放")
-                    else:
-                        print(f"✗ {channel_name} - 子项{i+1}不可播放 (HTTP {response.status_code})")
-                except requests.exceptions.Timeout:
-                    print(f"✗ {channel_name} - 子项{i+1}请求超时")
-                except requests.exceptions.RequestException as e:
-                    print(f"✗ {channel_name} - 子项{i+1}网络错误: {str(e)}")
-                except Exception as e:
-                    print(f"⚠ {channel_name} - 子项{i+1}检测错误: {str(e)}")
-            
-            # 根据检测结果决定如何处理这个频道组
-            if main_playable:
-                # 主项可用，保留主项和所有可用的子项
-                final_channels[channel_name] = {
-                    "source_url": channel_group.get('source_url'),
-                    "channel_name": channel_group.get('channel_name'),
-                    "stream_url": main_stream_url,
-                    "attributes": channel_group.get('attributes', {}),
-                    "childlist": playable_childlist
-                }
-            elif playable_childlist:
-                # 主项不可用但有可用的子项，将第一个可用子项提升为主项
-                first_playable = playable_childlist[0]
-                final_channels[channel_name] = {
-                    "source_url": first_playable.get('source_url'),
-                    "channel_name": channel_group.get('channel_name'),
-                    "stream_url": first_playable.get('stream_url'),
-                    "attributes": first_playable.get('attributes', {}),
-                    "childlist": playable_childlist[1:]  # 剩余的子项
-                }
-                print(f"↑ {channel_name} - 主项已替换为第一个可用子项")
-            else:
-                # 主项和所有子项都不可用，跳过这个频道组
-                print(f"⊘ {channel_name} - 所有项都不可播放，已删除")
-                continue
-            
-            checked_groups += 1
-            
-            # 每检测10个频道组就保存一次
-            if checked_groups % 10 == 0 or checked_groups == len(channels):
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    json.dump(final_channels, f, ensure_ascii=False, indent=2)
-                print(f"进度: {checked_groups}/{len(channels)}, 有效频道组: {len(final_channels)}")
+        # 合并NDJSON为最终文件，保持输入文件中的频道组顺序
+        final_channels = ndjson_to_json(ndjson_file, output_file, key_order=channel_names, pretty=pretty)
+        os.remove(ndjson_file)
         
         print(f"重新检测完成！共 {len(final_channels)} 个有效频道组，已保存到 {output_file}")
         return {
             "success": True,
-            "total_groups": len(channels),
+            "total_groups": len(channel_names),
             "final_groups": len(final_channels),
             "output_file": output_file
         }
         
     except FileNotFoundError:
         return {"error": f"文件未找到: {input_file}"}
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, ijson.JSONError):
         return {"error": f"JSON文件格式错误: {input_file}"}
     except Exception as e:
         return {"error": f"处理文件时出错: {str(e)}"}
 
-def main():
+def main(keep_all_children=True, pretty=False):
     print("开始重新检测整理后的频道数据...")
-    if os.path.exists("channels_final.json"):
-        os.remove("channels_final.json")
-    result = recheck_arranged_channels()
+    result = recheck_arranged_channels(keep_all_children=keep_all_children, pretty=pretty)
     if result.get("success"):
         print("✓ 频道数据重新检测完成！")
         print(f"• 原始频道组数: {result['total_groups']}")
@@ -140,4 +305,9 @@ def main():
         print(f"✗ 重新检测失败: {result.get('error')}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="重新检测channels_arrange.json中的播放地址，生成channels_final.json")
+    parser.add_argument("--first-playable", action="store_true",
+                        help="每个频道组只保留第一个可播放的地址，找到后不再检测其余子项")
+    parser.add_argument("--pretty", action="store_true", help="以缩进格式写入channels_final.json，方便人工查看")
+    args = parser.parse_args()
+    main(keep_all_children=not args.first_playable, pretty=args.pretty)
@@ -1,27 +1,72 @@
 import os
-from supabase import create_client, Client
-from typing import List, Dict, Optional
-import json
+from typing import List, Dict, Optional, TYPE_CHECKING
+import ijson
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+
+# 每次请求批量写入的最大行数
+BATCH_SIZE = 500
+# 同时进行的子源批量插入请求数
+MAX_INSERT_WORKERS = 20
+# Supabase请求使用的HTTP连接池大小，需大于MAX_INSERT_WORKERS
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 50
+# 缺少attributes时共用的空字典，只读
+_EMPTY = {}
+# channels和channel_sources表可写入的字段
+_CHANNEL_KEYS = frozenset(("channel_key", "source_url", "channel_name", "stream_url",
+                           "tvg_name", "tvg_id", "tvg_logo", "group_title"))
+_CHANNEL_SOURCE_KEYS = frozenset(("parent_channel_id", "source_url", "stream_url",
+                                  "tvg_name", "tvg_id", "tvg_logo", "group_title"))
 
 
 class ChannelDB:
     def __init__(self):
         """
-        初始化Supabase客户端
+        初始化Supabase连接配置，客户端在第一次访问supabase属性时才创建
         需要设置环境变量：
         SUPABASE_URL=your_supabase_url
         SUPABASE_KEY=your_supabase_key
         """
-        try:
-            self.url: str =  "https://eeuwpcynygzohstndlxf.supabase.co"
-            self.key: str = "sb_secret_C-HpaYbH0gGYtivfb6j_1A_hkdWVKVy"
-            if not self.url or not self.key:
-                raise ValueError("请设置SUPABASE_URL和SUPABASE_KEY环境变量")
-            
-            self.supabase: Client = create_client(self.url, self.key)
-        except Exception as e:
-            print(f"初始化Supabase客户端失败: {e}")
-            raise
+        self.url: str =  "https://eeuwpcynygzohstndlxf.supabase.co"
+        self.key: str = "sb_secret_C-HpaYbH0gGYtivfb6j_1A_hkdWVKVy"
+        if not self.url or not self.key:
+            raise ValueError("请设置SUPABASE_URL和SUPABASE_KEY环境变量")
+        self._supabase: Optional["Client"] = None
+        # 创建客户端时的异常，失败后再次访问直接抛出，不重复创建
+        self._supabase_error: Optional[Exception] = None
+
+    @property
+    def supabase(self) -> "Client":
+        """
+        Supabase客户端，第一次访问时导入supabase并创建
+        不访问数据库的流程不必承担导入supabase及建立HTTP客户端的开销
+        创建失败时记录异常，之后的访问直接抛出同一个异常
+        """
+        if self._supabase is None:
+            if self._supabase_error is not None:
+                raise self._supabase_error
+            try:
+                import httpx
+                from supabase import create_client, ClientOptions
+                
+                # 默认的httpx连接池只有10个连接；启用HTTP/2后并发的批量插入可复用同一个TCP/TLS连接
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS),
+                    http2=True,
+                    timeout=ClientOptions.postgrest_client_timeout
+                )
+                self._supabase = create_client(self.url, self.key, ClientOptions(httpx_client=http_client))
+            except Exception as e:
+                print(f"初始化Supabase客户端失败: {e}")
+                self._supabase_error = e
+                raise
+        return self._supabase
 
     def insert_channel(self, channel_data: Dict) -> Optional[Dict]:
         """
@@ -44,17 +89,8 @@ class ChannelDB:
             dict: 插入的记录或None
         """
         try:
-            # 准备插入数据
-            data = {
-                "channel_key": channel_data.get("channel_key"),
-                "source_url": channel_data.get("source_url"),
-                "channel_name": channel_data.get("channel_name"),
-                "stream_url": channel_data.get("stream_url"),
-                "tvg_name": channel_data.get("tvg_name"),
-                "tvg_id": channel_data.get("tvg_id"),
-                "tvg_logo": channel_data.get("tvg_logo"),
-                "group_title": channel_data.get("group_title")
-            }
+            # 只保留表中存在的字段，未提供的字段由数据库填充为NULL
+            data = {k: v for k, v in channel_data.items() if k in _CHANNEL_KEYS}
             
             # 插入数据
             result = self.supabase.table("channels").insert(data).execute()
@@ -86,16 +122,8 @@ class ChannelDB:
             dict: 插入的记录或None
         """
         try:
-            # 准备插入数据
-            data = {
-                "parent_channel_id": source_data.get("parent_channel_id"),
-                "source_url": source_data.get("source_url"),
-                "stream_url": source_data.get("stream_url"),
-                "tvg_name": source_data.get("tvg_name"),
-                "tvg_id": source_data.get("tvg_id"),
-                "tvg_logo": source_data.get("tvg_logo"),
-                "group_title": source_data.get("group_title")
-            }
+            # 只保留表中存在的字段，未提供的字段由数据库填充为NULL
+            data = {k: v for k, v in source_data.items() if k in _CHANNEL_SOURCE_KEYS}
             
             # 插入数据
             result = self.supabase.table("channel_sources").insert(data).execute()
@@ -107,6 +135,40 @@ class ChannelDB:
             print(f"插入频道源数据失败: {e}")
             return None
 
+    def insert_channels(self, channels_data: List[Dict]) -> List[Dict]:
+        """
+        批量插入主频道记录，一次请求写入整批数据
+        
+        Args:
+            channels_data (list): 频道数据列表，每项格式同insert_channel
+        
+        Returns:
+            list: 插入的记录（包含数据库生成的id），失败时为空列表
+        """
+        try:
+            result = self.supabase.table("channels").insert(channels_data).execute()
+            return result.data if result.data else []
+        except Exception as e:
+            print(f"批量插入频道数据失败: {e}")
+            return []
+
+    def insert_channel_sources(self, sources_data: List[Dict]) -> List[Dict]:
+        """
+        批量插入频道源记录，一次请求写入整批数据
+        
+        Args:
+            sources_data (list): 频道源数据列表，每项格式同insert_channel_source
+        
+        Returns:
+            list: 插入的记录，失败时为空列表
+        """
+        try:
+            result = self.supabase.table("channel_sources").insert(sources_data).execute()
+            return result.data if result.data else []
+        except Exception as e:
+            print(f"批量插入频道源数据失败: {e}")
+            return []
+
     def get_channel_by_key(self, channel_key: str) -> Optional[Dict]:
         """
         根据频道键获取频道信息
@@ -271,53 +333,60 @@ class ChannelDB:
             dict: 处理结果统计
         """
         try:
-            # 读取JSON文件
-            with open(json_file_path, 'r', encoding='utf-8') as f:
-                channels_data = json.load(f)
-            
             success_count = 0
             error_count = 0
             errors = []
             
-            # 遍历所有频道
-            for channel_key, channel_info in channels_data.items():
-                try:
-                    # 插入主频道
-                    channel_data = {
-                        "channel_key": channel_key,
-                        "source_url": channel_info.get("source_url"),
-                        "channel_name": channel_info.get("channel_name"),
-                        "stream_url": channel_info.get("stream_url"),
-                        "tvg_name": channel_info.get("attributes", {}).get("tvg-name"),
-                        "tvg_id": channel_info.get("attributes", {}).get("tvg-id"),
-                        "tvg_logo": channel_info.get("attributes", {}).get("tvg-logo"),
-                        "group_title": channel_info.get("attributes", {}).get("group-title")
-                    }
+            # 流式读取JSON文件，每解析出BATCH_SIZE个频道为一批，主频道和子源各用一次请求批量插入
+            with open(json_file_path, 'rb', buffering=1 << 16) as f, \
+                    ThreadPoolExecutor(max_workers=MAX_INSERT_WORKERS) as executor:
+                channel_items = ijson.kvitems(f, '', use_float=True)
+                while True:
+                    batch = list(islice(channel_items, BATCH_SIZE))
+                    if not batch:
+                        break
+                    channels_batch = []
+                    for channel_key, channel_info in batch:
+                        attributes = channel_info.get("attributes") or _EMPTY
+                        channels_batch.append({
+                            "channel_key": channel_key,
+                            "source_url": channel_info.get("source_url"),
+                            "channel_name": channel_info.get("channel_name"),
+                            "stream_url": channel_info.get("stream_url"),
+                            "tvg_name": attributes.get("tvg-name"),
+                            "tvg_id": attributes.get("tvg-id"),
+                            "tvg_logo": attributes.get("tvg-logo"),
+                            "group_title": attributes.get("group-title")
+                        })
+                
+                    # 按channel_key找回数据库生成的频道ID
+                    channel_ids = {row["channel_key"]: row["id"] for row in self.insert_channels(channels_batch)}
+                
+                    sources_batch = []
+                    for channel_key, channel_info in batch:
+                        channel_id = channel_ids.get(channel_key)
+                        if channel_id is None:
+                            error_count += 1
+                            errors.append(f"插入频道失败: {channel_key}")
+                            continue
                     
-                    channel_result = self.insert_channel(channel_data)
-                    if channel_result:
                         success_count += 1
-                        channel_id = channel_result["id"]
-                        
-                        # 插入子源
-                        childlist = channel_info.get("childlist", [])
-                        for child_source in childlist:
-                            source_data = {
+                        for child_source in channel_info.get("childlist", []):
+                            attributes = child_source.get("attributes") or _EMPTY
+                            sources_batch.append({
                                 "parent_channel_id": channel_id,
                                 "source_url": child_source.get("source_url"),
                                 "stream_url": child_source.get("stream_url"),
-                                "tvg_name": child_source.get("attributes", {}).get("tvg-name"),
-                                "tvg_id": child_source.get("attributes", {}).get("tvg-id"),
-                                "tvg_logo": child_source.get("attributes", {}).get("tvg-logo"),
-                                "group_title": child_source.get("attributes", {}).get("group-title")
-                            }
-                            self.insert_channel_source(source_data)
-                    else:
-                        error_count += 1
-                        errors.append(f"插入频道失败: {channel_key}")
-                except Exception as e:
-                    error_count += 1
-                    errors.append(f"处理频道 {channel_key} 时出错: {str(e)}")
+                                "tvg_name": attributes.get("tvg-name"),
+                                "tvg_id": attributes.get("tvg-id"),
+                                "tvg_logo": attributes.get("tvg-logo"),
+                                "group_title": attributes.get("group-title")
+                            })
+                
+                    # 子源交给线程池并发插入，同时继续处理下一批频道
+                    for source_start in range(0, len(sources_batch), BATCH_SIZE):
+                        executor.submit(self.insert_channel_sources,
+                                        sources_batch[source_start:source_start + BATCH_SIZE])
             
             return {
                 "success": True,
@@ -348,6 +417,8 @@ def main():
         
         # 初始化数据库连接
         db = ChannelDB()
+        # 客户端在第一次访问时创建，在此处访问使创建失败时直接中止
+        db.supabase
         print("✓ 数据库连接初始化成功")
         print("开始同步频道数据到数据库...")
         
@@ -384,6 +455,8 @@ def clear_database():
     try:
         # 初始化数据库连接
         db = ChannelDB()
+        # 客户端在第一次访问时创建，在此处访问使创建失败时直接中止
+        db.supabase
         print("✓ 数据库连接初始化成功")
         
         # 清空所有数据